@@ -1,36 +1,116 @@
 """Boolean expression trees, with serialization."""
 
-import collections
+import re
+import weakref
+from operator import and_, or_
 
-AndExpr = collections.namedtuple('AndExpr', ['exprs'])
-OrExpr = collections.namedtuple('OrExpr', ['exprs'])
-NotExpr = collections.namedtuple('NotExpr', ['expr'])
-Variable = collections.namedtuple('Variable', ['name'])
+# Hash-consing table: nodes are interned on construction, so structurally
+# equal nodes are the same object and compare and hash by identity.
+_intern = weakref.WeakValueDictionary()
+
+def _cons(cls, *args):
+    key = (cls,) + args
+    node = _intern.get(key)
+    if node is None:
+        node = object.__new__(cls)
+        for field, value in zip(cls.__slots__, args):
+            object.__setattr__(node, field, value)
+        _intern[key] = node
+    return node
+
+class _Node(object):
+    """Base class for immutable, interned expression nodes."""
+
+    __slots__ = ('__weakref__',)
+
+    # Integer type tag, so hot loops dispatch with one comparison instead of
+    # isinstance calls: 0=Variable, 1=NotExpr, 2=AndExpr, 3=OrExpr.
+    tag = -1
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % (field, getattr(self, field))
+            for field in self.__slots__))
+
+    def __reduce__(self):
+        return (type(self),
+                tuple(getattr(self, field) for field in self.__slots__))
+
+class AndExpr(_Node):
+    __slots__ = ('exprs',)
+    tag = 2
+
+    def __new__(cls, exprs):
+        return _cons(cls, _sorted_exprs(set(exprs)))
+
+class OrExpr(_Node):
+    __slots__ = ('exprs',)
+    tag = 3
+
+    def __new__(cls, exprs):
+        return _cons(cls, _sorted_exprs(set(exprs)))
+
+class NotExpr(_Node):
+    __slots__ = ('expr',)
+    tag = 1
+
+    def __new__(cls, expr):
+        return _cons(cls, expr)
+
+class Variable(_Node):
+    __slots__ = ('name',)
+    tag = 0
+
+    def __new__(cls, name):
+        return var(name)
+
+# Variables are few and long-lived, so they are kept in a plain dict that
+# is cheaper to probe than the weak intern table.
+_VAR_CACHE = {}
+
+def var(name):
+    """Return the Variable node for name."""
+    v = _VAR_CACHE.get(name)
+    if v is None:
+        v = _VAR_CACHE[name] = _cons(Variable, name)
+    return v
+
+def _sorted_exprs(exprs):
+    # And/Or children are stored as a tuple rather than a frozenset, which
+    # is smaller and cheaper to hash. Children are interned, so sorting the
+    # deduplicated set by identity gives each set of children one tuple.
+    return tuple(sorted(exprs, key=id))
 
 def make_not(expr):
-    return NotExpr(expr)
+    return _cons(NotExpr, expr)
 
 def make_or(exprs):
-    exprs = frozenset(exprs)
+    exprs = set(exprs)
     if not exprs:
         return False
     elif len(exprs) == 1:
-        return list(exprs)[0]
+        return next(iter(exprs))
     else:
-        return OrExpr(exprs)
+        return _cons(OrExpr, _sorted_exprs(exprs))
 
 def make_and(exprs):
-    exprs = frozenset(exprs)
+    exprs = set(exprs)
     if not exprs:
         return True
     elif len(exprs) == 1:
-        return list(exprs)[0]
+        return next(iter(exprs))
     else:
-        return AndExpr(exprs)
+        return _cons(AndExpr, _sorted_exprs(exprs))
 
 def parse(input):
     """Parse a string into an expression tree."""
-    tokens = _parse_into_tokens(iter(input))
+    tokens = iter(_parse_into_tokens(input))
     expr = _parse_into_tree(tokens)
     try:
         next(tokens)
@@ -39,176 +119,580 @@ def parse(input):
     else:
         raise ValueError('Parse error (expected end of input).')
 
+# Any character that is not a letter, whitespace or a token symbol.
+_INVALID_RE = re.compile(r'(?![^\W\d_])[^ \t\n()&|~01]')
+_TOKEN_RE = re.compile(r'[^\W\d_]+|[()&|~01]')
+
 def _parse_into_tokens(input):
-    yield '('
-    token = []
-    for symbol in input:
-        if symbol.isalpha():
-            token.append(symbol)
-        elif token:
-            yield ''.join(token)
-            token = []
-
-        if symbol in (' ', '\t', '\n'):
-            continue
-        elif symbol in ('(', ')', '&', '|', '~', '0', '1'):
-            yield symbol
-        elif not symbol.isalpha():
-            raise ValueError('Parse error (invalid symbol).')
-    if token:
-        yield ''.join(token)
-    yield ')'
+    # Lex the whole input up front: one search rejects invalid symbols and
+    # one findall returns every token, skipping whitespace, without running
+    # Python code per token.
+    if _INVALID_RE.search(input):
+        raise ValueError('Parse error (invalid symbol).')
+    tokens = _TOKEN_RE.findall(input)
+    tokens.insert(0, '(')
+    tokens.append(')')
+    return tokens
 
 def _parse_into_tree(tokens):
-    while True:
-        token = next(tokens)
-        if token == '~':
-            return make_not(_parse_into_tree(tokens))
-        elif token == '0':
-            return False
-        elif token == '1':
-            return True
-        elif token.isalpha():
-            return Variable(token)
-        elif token == '(':
-            operator = None
-            exprs = []
-            while True:
-                exprs.append(_parse_into_tree(tokens))
-                token = next(tokens)
-                if token == ')':
-                    break
-                elif operator is not None and token != operator:
-                    raise ValueError('Parse error (operator disagreement).')
-                else:
-                    operator = token
+    # Shift/reduce loop instead of recursive descent. Each open parenthesis
+    # pushes an [operator, exprs, negations] frame, where negations counts
+    # the '~' prefixes that apply to the group once it is closed.
+    frames = []
+    negations = 0
+    expect_operand = True
+    for token in tokens:
+        if expect_operand:
+            if token == '~':
+                negations += 1
+                continue
+            elif token == '(':
+                frames.append([None, [], negations])
+                negations = 0
+                continue
+            elif token == '0':
+                expr = False
+            elif token == '1':
+                expr = True
+            elif token.isalpha():
+                expr = var(token)
+            else:
+                raise ValueError('Parse error (unxpected token).')
+        elif token != ')':
+            frame = frames[-1]
+            if frame[0] is not None and token != frame[0]:
+                raise ValueError('Parse error (operator disagreement).')
+            frame[0] = token
+            expect_operand = True
+            continue
+        else:
+            operator, exprs, negations = frames.pop()
             if operator == '&':
-                return make_and(exprs)
+                expr = make_and(exprs)
             elif operator == '|':
-                return make_or(exprs)
+                expr = make_or(exprs)
             elif len(exprs) == 1 and operator is None:
-                return exprs[0]
+                expr = exprs[0]
             else:
                 raise ValueError('Parse error (invalid operator).')
-        else:
-            raise ValueError('Parse error (unxpected token).') 
-    
+
+        for _ in range(negations):
+            expr = make_not(expr)
+        negations = 0
+        if not frames:
+            return expr
+        frames[-1][1].append(expr)
+        expect_operand = False
+    raise ValueError('Parse error (unexpected end of input).')
+
 def format(expr):
     """Format an expression tree as a string."""
-    chunks = []
-    _format_chunks(expr, chunks, outer=True)
-    return ''.join(chunks)
-
-def _format_chunks(expr, chunks, outer=False):
-    if expr is True:
-        chunks.append('1')
-    elif expr is False:
-        chunks.append('0')
-    elif isinstance(expr, (AndExpr, OrExpr)):
-        if isinstance(expr, AndExpr):
-            operator = '&'
+    buf = bytearray()
+    _format_into(expr, buf)
+    return buf.decode('utf-8')
+
+def _format_into(expr, buf):
+    # Stack entries are (text, expr) pairs: literal bytes are written as-is,
+    # otherwise the expression is expanded in place.
+    stack = [(None, expr)]
+    while stack:
+        text, expr = stack.pop()
+        if text is not None:
+            buf += text
+            continue
+        elif expr is True:
+            buf += b'1'
+            continue
+        elif expr is False:
+            buf += b'0'
+            continue
+        tag = getattr(expr, 'tag', -1)
+        if tag == 2 or tag == 3:
+            if tag == 2:
+                operator = b'&'
+            else:
+                operator = b'|'
+            buf += b'('
+            stack.append((b')', None))
+            # Pushed in reverse, with the separator written before every
+            # child except the first.
+            first = True
+            for subexpr in reversed(expr.exprs):
+                if not first:
+                    stack.append((operator, None))
+                stack.append((None, subexpr))
+                first = False
+        elif tag == 1:
+            buf += b'~'
+            stack.append((None, expr.expr))
+        elif tag == 0:
+            buf += expr.name.encode('utf-8')
         else:
-            operator = '|'
-        chunks.append('(')
-        for i, subexpr in enumerate(expr.exprs):
-            _format_chunks(subexpr, chunks)
-            if i < len(expr.exprs) - 1:
-                chunks.append(operator)
-        chunks.append(')')
-    elif isinstance(expr, NotExpr):
-        chunks.append('~')
-        _format_chunks(expr.expr, chunks)
-    elif isinstance(expr, Variable):
-        chunks.append(expr.name)
-    else:
-        raise TypeError('Unexpected expression type %r' % type(expr))
+            raise TypeError('Unexpected expression type %r' % type(expr))
+
+def _pop_results(results, count):
+    start = len(results) - count
+    popped = results[start:]
+    del results[start:]
+    return popped
 
 def simplify(expr):
     """Apply basic simplification rules."""
-    if isinstance(expr, NotExpr):
-        subexpr = simplify(expr.expr)
+    if getattr(expr, 'tag', -1) == 2:
+        result = _simplify_cnf(expr)
+        if result is not None:
+            return result
 
-        # Remove double-negation.
-        if isinstance(subexpr, NotExpr):
-            return subexpr.expr
+    # Post-order walk: each node is visited once to schedule its children
+    # and again to combine their simplified forms from the results stack.
+    # Results are memoized per interned node so shared subtrees are only
+    # simplified once.
+    memo = {}
+    stack = [(expr, False)]
+    results = []
+    # Bind the hot lookups to locals: the loop runs once or twice per node.
+    push, pop, emit = stack.append, stack.pop, results.append
+    while stack:
+        expr, visited = pop()
+        if visited:
+            tag = expr.tag
+            if tag == 1:
+                result = _simplify_not(results.pop())
+            else:
+                subexprs = _pop_results(results, len(expr.exprs))
+                if tag == 2:
+                    result = _simplify_and(subexprs)
+                else:
+                    result = _simplify_or(subexprs)
+            memo[expr] = result
+            emit(result)
+        elif expr in memo:
+            emit(memo[expr])
+        else:
+            tag = getattr(expr, 'tag', -1)
+            if tag == 1:
+                push((expr, True))
+                push((expr.expr, False))
+            elif tag == 2 or tag == 3:
+                push((expr, True))
+                stack.extend([(subexpr, False) for subexpr in expr.exprs])
+            else:
+                emit(expr)
+    return results.pop()
 
-        # ~1 -> 0
-        if subexpr is True:
-            return False
+def _simplify_cnf(expr):
+    # Fast path for a conjunction of clauses of literals, the usual solver
+    # input. The only rule that applies there is dropping tautological
+    # clauses (a|~a|...), so do that in one pass. Returns None if the
+    # expression is not in that shape.
+    clauses = []
+    for clause in expr.exprs:
+        # Empty or single-literal Or nodes (only buildable through the
+        # OrExpr constructor) need the generic rules to normalize them.
+        if getattr(clause, 'tag', -1) != 3 or len(clause.exprs) < 2:
+            return None
+        negated = set()
+        for literal in clause.exprs:
+            tag = getattr(literal, 'tag', -1)
+            if tag == 1 and getattr(literal.expr, 'tag', -1) == 0:
+                negated.add(literal.expr)
+            elif tag != 0:
+                return None
+        if negated.isdisjoint(clause.exprs):
+            clauses.append(clause)
+    return make_and(clauses)
 
-        # ~0 -> 1
-        if subexpr is False:
-            return True
+def _simplify_not(subexpr):
+    # ~1 -> 0
+    if subexpr is True:
+        return False
+
+    # ~0 -> 1
+    if subexpr is False:
+        return True
 
-        return make_not(subexpr)
+    # Remove double-negation.
+    if getattr(subexpr, 'tag', -1) == 1:
+        return subexpr.expr
 
-    elif isinstance(expr, AndExpr):
-        subexprs = set([simplify(subexpr) for subexpr in expr.exprs])
+    return make_not(subexpr)
 
+def _simplify_and(subexprs):
+    simplified = set()
+    nested = []
+    for subexpr in subexprs:
         # (0&...) -> 0
-        if False in subexprs:
+        if subexpr is False:
             return False
 
+        # (1&a) -> a
+        if subexpr is True:
+            continue
+
         # ((a&b)&c) -> (a&b&c)
-        flattened_subexprs = set()
-        for subexpr in subexprs:
-            if isinstance(subexpr, AndExpr):
-                flattened_subexprs |= subexpr.exprs
-            else:
-                flattened_subexprs.add(subexpr)
-        subexprs = flattened_subexprs
+        if getattr(subexpr, 'tag', -1) == 2:
+            nested.append(subexpr.exprs)
+        else:
+            simplified.add(subexpr)
 
-        # (1&a) -> a
-        subexprs.discard(True)
+    simplified.update(*nested)
 
-        return make_and(subexprs)
+    # (a&~a) -> 0
+    for subexpr in simplified:
+        if getattr(subexpr, 'tag', -1) == 1 and subexpr.expr in simplified:
+            return False
 
-    elif isinstance(expr, OrExpr):
-        subexprs = set([simplify(subexpr) for subexpr in expr.exprs])
+    # (a&(a|b)) -> a
+    simplified.difference_update([
+        subexpr for subexpr in simplified
+        if getattr(subexpr, 'tag', -1) == 3
+        and not simplified.isdisjoint(subexpr.exprs)])
 
+    return make_and(simplified)
+
+def _simplify_or(subexprs):
+    simplified = set()
+    nested = []
+    for subexpr in subexprs:
         # (1|...) -> 1
-        if True in subexprs:
+        if subexpr is True:
             return True
 
+        # (0|a) -> a
+        if subexpr is False:
+            continue
+
         # ((a|b)|c) -> (a|b|c)
-        flattened_subexprs = set()
-        for subexpr in subexprs:
-            if isinstance(subexpr, OrExpr):
-                flattened_subexprs |= subexpr.exprs
-            else:
-                flattened_subexprs.add(subexpr)
-        subexprs = flattened_subexprs
+        if getattr(subexpr, 'tag', -1) == 3:
+            nested.append(subexpr.exprs)
+        else:
+            simplified.add(subexpr)
 
-        # (1|a) -> a
-        subexprs.discard(False)
+    simplified.update(*nested)
 
-        return make_or(subexprs)
+    # (a|~a) -> 1
+    for subexpr in simplified:
+        if getattr(subexpr, 'tag', -1) == 1 and subexpr.expr in simplified:
+            return True
 
-    else:
-        return expr
+    # (a|(a&b)) -> a
+    simplified.difference_update([
+        subexpr for subexpr in simplified
+        if getattr(subexpr, 'tag', -1) == 2
+        and not simplified.isdisjoint(subexpr.exprs)])
+
+    return make_or(simplified)
 
 def substitute(expr, vars):
-    if isinstance(expr, Variable):
-        return vars.get(expr.name, expr)
-    if isinstance(expr, NotExpr):
-        return make_not(substitute(expr.expr, vars))
-    if isinstance(expr, AndExpr):
-        return make_and(substitute(subexpr, vars) for subexpr in expr.exprs)
-    if isinstance(expr, OrExpr):
-        return make_or(substitute(subexpr, vars) for subexpr in expr.exprs)
-    return expr
+    memo = {}
+    stack = [(expr, False)]
+    results = []
+    push, pop, emit = stack.append, stack.pop, results.append
+    while stack:
+        expr, visited = pop()
+        if visited:
+            tag = expr.tag
+            if tag == 1:
+                result = make_not(results.pop())
+            else:
+                subexprs = _pop_results(results, len(expr.exprs))
+                if tag == 2:
+                    result = make_and(subexprs)
+                else:
+                    result = make_or(subexprs)
+            memo[expr] = result
+            emit(result)
+        elif expr in memo:
+            emit(memo[expr])
+        else:
+            tag = getattr(expr, 'tag', -1)
+            if tag == 0:
+                emit(vars.get(expr.name, expr))
+            elif tag == 1:
+                push((expr, True))
+                push((expr.expr, False))
+            elif tag == 2 or tag == 3:
+                push((expr, True))
+                stack.extend([(subexpr, False) for subexpr in expr.exprs])
+            else:
+                emit(expr)
+    return results.pop()
 
 def evaluate(expr, vars):
     return simplify(substitute(expr, vars))
 
+# Support sets of interned nodes, computed on first use.
+_variables_cache = weakref.WeakKeyDictionary()
+
 def variables(expr):
-    if isinstance(expr, Variable):
-        return {expr.name}
-    if isinstance(expr, NotExpr):
-        return variables(expr.expr)
-    if isinstance(expr, (AndExpr, OrExpr)):
-        v = set()
-        for subexpr in expr.exprs:
-            v |= variables(subexpr)
-        return v
-    return set()
+    if getattr(expr, 'tag', -1) < 0:
+        return frozenset()
+    stack = [(expr, False)]
+    while stack:
+        node, visited = stack.pop()
+        tag = getattr(node, 'tag', -1)
+        if tag < 0 or node in _variables_cache:
+            continue
+        elif tag == 0:
+            _variables_cache[node] = frozenset([node.name])
+        elif visited:
+            if tag == 1:
+                subexprs = [node.expr]
+            else:
+                subexprs = node.exprs
+            _variables_cache[node] = frozenset().union(*[
+                _variables_cache[subexpr] for subexpr in subexprs
+                if getattr(subexpr, 'tag', -1) >= 0])
+        else:
+            stack.append((node, True))
+            if tag == 1:
+                stack.append((node.expr, False))
+            else:
+                stack.extend([(subexpr, False) for subexpr in node.exprs])
+    return _variables_cache[expr]
+
+# Maximum operands per generated line in compile().
+_COMPILE_CHUNK = 64
+
+def compile(expr, var_order=None):
+    """Compile an expression into a function of a packed assignment.
+
+    The returned function takes an integer whose bit k is the value of
+    var_order[k] (by default the sorted variable names) and returns the
+    value of the expression as a bool.
+    """
+    if var_order is None:
+        var_order = sorted(variables(expr))
+    index = {name: k for k, name in enumerate(var_order)}
+
+    # Emit straight-line code in post-order, one local per distinct node, so
+    # evaluation runs without any tree walking or type dispatch. Wide And/Or
+    # nodes are accumulated over several lines of at most _COMPILE_CHUNK
+    # operands each, since one long a & b & ... chain nests the compiler's
+    # recursion once per operand.
+    names = {True: '1', False: '0'}
+    lines = []
+    stack = [(expr, False)]
+    while stack:
+        node, visited = stack.pop()
+        if node in names:
+            continue
+        name = 't%d' % (len(names) - 2)
+        tag = getattr(node, 'tag', -1)
+        if tag == 0:
+            if node.name not in index:
+                raise ValueError('Variable %r is not in var_order' % node.name)
+            lines.append('%s = bits >> %d & 1' % (name, index[node.name]))
+        elif visited:
+            if tag == 1:
+                lines.append('%s = %s ^ 1' % (name, names[node.expr]))
+            else:
+                operator = ' & ' if tag == 2 else ' | '
+                operands = [names[subexpr] for subexpr in node.exprs]
+                for i in range(0, len(operands), _COMPILE_CHUNK):
+                    chunk = operands[i:i + _COMPILE_CHUNK]
+                    if i:
+                        chunk.insert(0, name)
+                    lines.append('%s = %s' % (name, operator.join(chunk)))
+        elif tag == 1:
+            stack.append((node, True))
+            stack.append((node.expr, False))
+            continue
+        elif tag == 2 or tag == 3:
+            stack.append((node, True))
+            stack.extend([(subexpr, False) for subexpr in node.exprs])
+            continue
+        else:
+            raise TypeError('Unexpected expression type %r' % type(node))
+        names[node] = name
+
+    source = 'def evaluate_bits(bits):\n%s    return %s == 1\n' % (
+        ''.join('    %s\n' % line for line in lines), names[expr])
+    namespace = {}
+    exec(source, namespace)
+    return namespace['evaluate_bits']
+
+# Largest variable count truth_table() accepts. Each table is 2**20 bits
+# (128KiB), and up to len(var_order) + depth + (live shared nodes) tables
+# are held at once; see truth_table().
+TRUTH_TABLE_MAX_VARIABLES = 20
+
+def truth_table(expr, var_order=None):
+    """Evaluate an expression under every assignment at once.
+
+    Returns an integer whose bit i is the value of the expression when bit k
+    of i is the value of var_order[k] (by default the sorted variable names).
+    Each table has 2**len(var_order) bits, so at most
+    TRUTH_TABLE_MAX_VARIABLES variables are accepted; use compile() to
+    evaluate larger formulas under individual assignments. Besides one table
+    per variable, memory holds one table per level of nesting and one per
+    shared subexpression still awaiting a parent, not one per node.
+    """
+    if var_order is None:
+        var_order = sorted(variables(expr))
+    if len(var_order) > TRUTH_TABLE_MAX_VARIABLES:
+        raise ValueError(
+            'Truth table over %d variables exceeds the limit of %d'
+            % (len(var_order), TRUTH_TABLE_MAX_VARIABLES))
+    size = 1 << len(var_order)
+    mask = (1 << size) - 1
+
+    # Python integers serve as bit vectors with one bit per assignment, so
+    # each &, | and ^ below evaluates all assignments in one C-level loop.
+    leaves = {True: mask, False: 0}
+    for k, name in enumerate(var_order):
+        leaves[var(name)] = _variable_lane(k, size)
+
+    # Count the parents of each distinct compound node, so the table of a
+    # shared node can be dropped once its last parent has used it.
+    parents = {}
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if node in leaves:
+            continue
+        tag = getattr(node, 'tag', -1)
+        if tag == 0:
+            raise ValueError('Variable %r is not in var_order' % node.name)
+        elif tag == 1:
+            subexprs = [node.expr]
+        elif tag == 2 or tag == 3:
+            subexprs = node.exprs
+        else:
+            raise TypeError('Unexpected expression type %r' % type(node))
+        for subexpr in subexprs:
+            if subexpr in leaves:
+                continue
+            if subexpr not in parents:
+                stack.append(subexpr)
+            parents[subexpr] = parents.get(subexpr, 0) + 1
+
+    # Depth-first evaluation where each frame folds its children into a
+    # running accumulator as they complete, so only the open frames and the
+    # pending shared nodes hold a table.
+    if expr in leaves:
+        return leaves[expr]
+    shared = {}
+    frames = [[expr, None, iter(_children(expr))]]
+    while True:
+        frame = frames[-1]
+        node, acc, subexprs = frame
+        subexpr = next(subexprs, None)
+        if subexpr is not None:
+            if subexpr in leaves:
+                value = leaves[subexpr]
+            elif subexpr in shared:
+                value = shared[subexpr]
+                parents[subexpr] -= 1
+                if not parents[subexpr]:
+                    del shared[subexpr]
+            else:
+                frames.append([subexpr, None, iter(_children(subexpr))])
+                continue
+        else:
+            frames.pop()
+            value = acc ^ mask if node.tag == 1 else acc
+            if not frames:
+                return value
+            if parents[node] > 1:
+                shared[node] = value
+                parents[node] -= 1
+            frame = frames[-1]
+            acc = frame[1]
+        if acc is None:
+            frame[1] = value
+        elif frame[0].tag == 2:
+            frame[1] = and_(acc, value)
+        else:
+            frame[1] = or_(acc, value)
+
+def _children(node):
+    if node.tag == 1:
+        return [node.expr]
+    return node.exprs
+
+def _variable_lane(k, size):
+    # Bit i is set iff bit k of i is set: runs of 2**k zeros then ones,
+    # doubled until the lane covers all size assignments.
+    half = 1 << k
+    lane = ((1 << half) - 1) << half
+    width = half << 1
+    while width < size:
+        lane |= lane << width
+        width <<= 1
+    return lane
+
+class BDDNode(_Node):
+    """Reduced ordered BDD node: high if var is true, else low."""
+
+    __slots__ = ('var', 'low', 'high')
+
+    def __new__(cls, var, low, high):
+        return _cons(cls, var, low, high)
+
+# (var_order, BDD) for interned expressions already canonicalized.
+_bdd_cache = weakref.WeakKeyDictionary()
+
+def canonicalize(expr, var_order=None):
+    """Convert an expression to a reduced ordered BDD.
+
+    Equivalent expressions give the same BDDNode (or constant) object when
+    built with the same var_order, which defaults to the sorted variable
+    names.
+    """
+    # Reject non-node leaves up front: they have no variables to expand on
+    # and cannot be weakly referenced by the cache.
+    seen = set()
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if node is True or node is False or node in seen:
+            continue
+        tag = getattr(node, 'tag', -1)
+        if tag < 0:
+            raise TypeError('Unexpected expression type %r' % type(node))
+        seen.add(node)
+        if tag == 1:
+            stack.append(node.expr)
+        elif tag == 2 or tag == 3:
+            stack.extend(node.exprs)
+
+    if var_order is None:
+        var_order = sorted(variables(expr))
+    order = tuple(var_order)
+    index = {name: k for k, name in enumerate(order)}
+    unknown = variables(expr).difference(index)
+    if unknown:
+        raise ValueError('Variable %r is not in var_order' % min(unknown))
+
+    # Shannon expansion on the first variable in order, memoized on the
+    # simplified residual expressions; interning makes equal residuals the
+    # same node, so each distinct cofactor is expanded once.
+    root = simplify(expr)
+    memo = {True: True, False: False}
+    stack = [(root, None)]
+    while stack:
+        node, branches = stack.pop()
+        if node in memo:
+            continue
+        elif getattr(node, 'tag', -1) < 0:
+            raise TypeError('Unexpected expression type %r' % type(node))
+        cached = _bdd_cache.get(node)
+        if cached is not None and cached[0] == order:
+            memo[node] = cached[1]
+        elif branches is None:
+            name = order[min(index[v] for v in variables(node))]
+            low = simplify(substitute(node, {name: False}))
+            high = simplify(substitute(node, {name: True}))
+            stack.append((node, (name, low, high)))
+            stack.append((low, None))
+            stack.append((high, None))
+        else:
+            name, low, high = branches
+            low, high = memo[low], memo[high]
+            memo[node] = low if low is high else BDDNode(name, low, high)
+            _bdd_cache[node] = (order, memo[node])
+
+    if getattr(expr, 'tag', -1) >= 0:
+        _bdd_cache[expr] = (order, memo[root])
+    return memo[root]
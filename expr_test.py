@@ -1,3 +1,5 @@
+import pickle
+import tracemalloc
 import unittest
 
 import expr
@@ -18,6 +20,19 @@ class ExprTest(unittest.TestCase):
         self.assertEqual(
             expr.make_and([False, True]), expr.AndExpr(frozenset([False, True])))
 
+    def test_interning(self):
+        self.assertIs(expr.parse('a&~b'), expr.parse('~b&a'))
+        self.assertIs(
+            expr.make_not(expr.Variable(name='a')),
+            expr.NotExpr(expr=expr.Variable(name='a')))
+        self.assertEqual(len(expr.parse('(a&b)|(a|b)').exprs), 2)
+        self.assertIs(expr.var('a'), expr.Variable(name='a'))
+        self.assertIs(expr.var('a'), expr.parse('a'))
+        e = expr.parse('(a|(a&b)|~d)')
+        self.assertIs(pickle.loads(pickle.dumps(e)), e)
+        with self.assertRaises(AttributeError):
+            e.exprs = frozenset()
+
     def test_parse_atoms(self):
         self.assertEqual(expr.parse('1'), True)
         self.assertEqual(expr.parse('0'), False)
@@ -49,6 +64,10 @@ class ExprTest(unittest.TestCase):
             expr.parse('(a&b)c')
         with self.assertRaises(ValueError):
             expr.parse('(a&b))')
+        with self.assertRaises(ValueError):
+            expr.parse('(a&b')
+        with self.assertRaises(ValueError):
+            expr.parse('a&~')
 
     def test_format_errors(self):
         with self.assertRaises(TypeError):
@@ -103,6 +122,40 @@ class ExprTest(unittest.TestCase):
         self.assertEqual(
             expr.simplify(expr.parse('a|(a|b)')), expr.parse('a|b'))
 
+    def test_simplify_complement(self):
+        self.assertEqual(expr.simplify(expr.parse('a&~a')), expr.parse('0'))
+        self.assertEqual(expr.simplify(expr.parse('a|~a')), expr.parse('1'))
+        self.assertEqual(
+            expr.simplify(expr.parse('b&(a&~~~a)')), expr.parse('0'))
+        self.assertEqual(
+            expr.simplify(expr.parse('(a&b)|c|~(a&b)')), expr.parse('1'))
+
+    def test_simplify_absorption(self):
+        self.assertEqual(expr.simplify(expr.parse('a&(a|b)')), expr.parse('a'))
+        self.assertEqual(expr.simplify(expr.parse('a|(a&b)')), expr.parse('a'))
+        self.assertEqual(
+            expr.simplify(expr.parse('a&c&(a|b)&(b|d)')), expr.parse('a&c&(b|d)'))
+        self.assertEqual(
+            expr.simplify(expr.parse('(a|b)&(a|b|c)')), expr.parse('(a|b)&(a|b|c)'))
+
+    def test_simplify_cnf(self):
+        self.assertEqual(
+            expr.simplify(expr.parse('(a|b)&(c|~c|d)&(~a|d)')),
+            expr.parse('(a|b)&(~a|d)'))
+        self.assertEqual(
+            expr.simplify(expr.parse('(a|~a)&(b|c)')), expr.parse('b|c'))
+        self.assertEqual(
+            expr.simplify(expr.parse('(a|~a)&(~b|b)')), expr.parse('1'))
+        self.assertEqual(
+            expr.simplify(expr.parse('(a|b)&(~~a|c)')), expr.parse('(a|b)&(a|c)'))
+        a, b, c = expr.var('a'), expr.var('b'), expr.var('c')
+        self.assertEqual(
+            expr.simplify(expr.AndExpr([expr.OrExpr([]), expr.OrExpr([b, c])])),
+            False)
+        self.assertEqual(
+            expr.simplify(expr.AndExpr([expr.OrExpr([a]), expr.OrExpr([b, c])])),
+            expr.parse('a&(b|c)'))
+
     def test_evaluate_constant(self):
         self.assertEqual(expr.evaluate(expr.parse('0'), {'a': True}), False)
         self.assertEqual(expr.evaluate(expr.parse('1'), {'a': True}), True)
@@ -134,6 +187,125 @@ class ExprTest(unittest.TestCase):
         self.assertEqual(expr.variables(expr.parse('~a')), {'a'})
         self.assertEqual(expr.variables(expr.parse('a&b')), {'a', 'b'})
         self.assertEqual(expr.variables(expr.parse('a|b')), {'a', 'b'})
+        self.assertEqual(expr.variables(expr.parse('a&(b|~c|1)')), {'a', 'b', 'c'})
+        e = expr.parse('a&~b')
+        self.assertIs(expr.variables(e), expr.variables(e))
+
+    def test_compile(self):
+        names = ['a', 'b', 'c']
+        inputs = ['0', '1', 'a', '~a', '(a|b)&(~a|c)&~(b&c)', '~~(a|~(b&c&1))|0']
+        for input in inputs:
+            e = expr.parse(input)
+            compiled = expr.compile(e, names)
+            for bits in range(8):
+                assignment = {
+                    name: bool(bits >> k & 1) for k, name in enumerate(names)}
+                self.assertEqual(compiled(bits), expr.evaluate(e, assignment))
+        with self.assertRaises(ValueError):
+            expr.compile(expr.parse('a&d'), names)
+
+    def test_compile_wide(self):
+        clauses = [
+            expr.make_or([expr.var('x%d' % i), expr.var('y%d' % i)])
+            for i in range(3000)]
+        cnf = expr.make_and(clauses)
+        var_order = ['x%d' % i for i in range(3000)]
+        var_order += ['y%d' % i for i in range(3000)]
+        compiled = expr.compile(cnf, var_order)
+        self.assertEqual(compiled((1 << 3000) - 1), True)
+        self.assertEqual(compiled((1 << 2999) - 1), False)
+        self.assertEqual(compiled(((1 << 2999) - 1) | (1 << 5999)), True)
+
+    def test_truth_table(self):
+        self.assertEqual(expr.truth_table(expr.parse('0')), 0)
+        self.assertEqual(expr.truth_table(expr.parse('1')), 1)
+        self.assertEqual(expr.truth_table(expr.parse('a&b')), 0b1000)
+        self.assertEqual(expr.truth_table(expr.parse('~a|b')), 0b1101)
+        names = ['a', 'b', 'c']
+        e = expr.parse('(a|b)&(~a|c)&~(b&c)')
+        table = expr.truth_table(e, names)
+        compiled = expr.compile(e, names)
+        for bits in range(8):
+            self.assertEqual(table >> bits & 1 == 1, compiled(bits))
+        with self.assertRaises(ValueError):
+            expr.truth_table(expr.parse('a&d'), names)
+        limit = expr.TRUTH_TABLE_MAX_VARIABLES
+        wide = expr.make_or(expr.var('v%d' % i) for i in range(limit))
+        self.assertEqual(expr.truth_table(wide), (1 << (1 << limit)) - 2)
+        with self.assertRaises(ValueError):
+            expr.truth_table(expr.make_or([wide, expr.var('w')]))
+
+    def test_truth_table_memory(self):
+        # Tables are dropped once used, so a long CNF holds roughly one per
+        # variable (plus its negation) rather than one per clause.
+        names = ['v%d' % i for i in range(expr.TRUTH_TABLE_MAX_VARIABLES)]
+        literals = [expr.var(name) for name in names]
+        literals += [expr.make_not(literal) for literal in literals]
+        cnf = expr.make_and(
+            expr.make_or([literals[i % 40], literals[i // 40],
+                          literals[i * 7 % 40]])
+            for i in range(1600))
+        table_bytes = (1 << len(names)) // 8
+        tracemalloc.start()
+        try:
+            expr.truth_table(cnf, names)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 100 * table_bytes)
+
+    def test_canonicalize(self):
+        def bdd(input):
+            return expr.canonicalize(expr.parse(input), ['a', 'b', 'c'])
+        self.assertIs(bdd('0'), False)
+        self.assertIs(bdd('a|~a'), True)
+        self.assertIs(bdd('a'), expr.BDDNode('a', False, True))
+        self.assertIs(bdd('~(a&b)'), bdd('~a|~b'))
+        self.assertIs(bdd('(a|b)&(a|c)'), bdd('a|(b&c)'))
+        self.assertIs(bdd('(a&b)|(~a&b)'), bdd('b'))
+        self.assertIsNot(bdd('a&b'), bdd('a|b'))
+        self.assertIs(
+            expr.canonicalize(expr.parse('b&~a')),
+            expr.canonicalize(expr.parse('~(a|~b)')))
+        with self.assertRaises(ValueError):
+            expr.canonicalize(expr.parse('a&d'), ['a', 'b', 'c'])
+        with self.assertRaises(TypeError):
+            expr.canonicalize('foo')
+        with self.assertRaises(TypeError):
+            expr.canonicalize(expr.make_not('foo'))
+        with self.assertRaises(TypeError):
+            expr.canonicalize(expr.make_and([expr.var('a'), 'foo']))
+
+    def test_deep_expressions(self):
+        deep = expr.Variable(name='a')
+        for i in range(10000):
+            deep = expr.make_not(expr.make_and([deep, expr.Variable(name='b')]))
+        self.assertEqual(expr.variables(deep), {'a', 'b'})
+        self.assertEqual(expr.evaluate(deep, {'b': True}), expr.parse('a'))
+        self.assertEqual(expr.evaluate(deep, {'b': False}), True)
+        self.assertEqual(len(expr.format(expr.simplify(deep))), 10000 * 5 + 1)
+        self.assertEqual(len(expr.format(deep)), 10000 * 5 + 1)
+        self.assertIs(expr.parse(expr.format(deep)), deep)
+        self.assertIs(
+            expr.parse('(' * 10000 + '~' * 10000 + 'a' + ')' * 10000),
+            expr.parse('~' * 10000 + 'a'))
+
+    def test_shared_subexpressions(self):
+        # Each level references the previous one twice, so the unshared
+        # tree has 2**50 leaves.
+        shared = expr.Variable(name='a')
+        names = {'a'}
+        for i in range(50):
+            left = expr.Variable(name='l%d' % i)
+            right = expr.Variable(name='r%d' % i)
+            names |= {left.name, right.name}
+            shared = expr.make_and(
+                [expr.make_or([shared, left]), expr.make_or([shared, right])])
+        self.assertEqual(expr.variables(shared), names)
+        self.assertEqual(expr.evaluate(shared, {'a': True}), True)
+        self.assertEqual(expr.variables(expr.simplify(shared)), names)
+        self.assertEqual(
+            expr.variables(expr.substitute(shared, {'a': False})), names - {'a'})
 
 if __name__ == '__main__':
     unittest.main()